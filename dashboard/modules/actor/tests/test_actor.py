@@ -8,27 +8,182 @@ import requests
 
 import ray
 import ray._private.gcs_pubsub as gcs_pubsub
+import ray._private.gcs_utils as gcs_utils
 import ray.dashboard.utils as dashboard_utils
 from ray._private.test_utils import format_web_url, wait_until_server_available
 from ray.dashboard.modules.actor import actor_consts
 from ray.dashboard.tests.conftest import *  # noqa
 
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
 logger = logging.getLogger(__name__)
 
+# Rough lower bound on the serialized size of one actor entry. Used to
+# skip JSON parsing of responses that cannot possibly contain the
+# expected number of actors yet.
+_MIN_ACTOR_ENTRY_BYTES = 64
+
+# ActorTableData fields that hold binary ids and need hex decoding.
+_BYTES_ID_FIELDS = frozenset(
+    {
+        "actorId",
+        "parentId",
+        "jobId",
+        "workerId",
+        "rayletId",
+        "callerId",
+        "taskId",
+        "parentTaskId",
+        "sourceActorId",
+        "placementGroupId",
+    }
+)
+
+# Fields expected in published ALIVE/DEAD and PENDING_CREATION messages.
+_ALIVE_DEAD_REQUIRED = frozenset(
+    {
+        "state",
+        "address",
+        "timestamp",
+        "pid",
+        "rayNamespace",
+    }
+)
+_PENDING_CREATION_KEYS = frozenset(
+    {
+        "state",
+        "address",
+        "actorId",
+        "jobId",
+        "ownerAddress",
+        "className",
+        "serializedRuntimeEnv",
+        "rayNamespace",
+        "functionDescriptor",
+        "actorCreationDummyObjectId",
+    }
+)
+
+
+# Defined at module scope so ray.remote's class wrapping runs once for
+# the whole module instead of once per test.
+@ray.remote
+class Foo:
+    def __init__(self, num):
+        self.num = num
+
+    def do_task(self):
+        return self.num
+
+
+@ray.remote(num_gpus=1)
+class InfeasibleActor:
+    pass
+
+
+@ray.remote
+class DummyActor:
+    def __init__(self):
+        pass
 
-def test_actors(disable_aiohttp_cache, ray_start_with_dashboard):
-    @ray.remote
-    class Foo:
-        def __init__(self, num):
-            self.num = num
 
-        def do_task(self):
-            return self.num
+@pytest.fixture
+def http_session():
+    """A keep-alive session so polls reuse one TCP connection."""
+    session = requests.Session()
+    session.headers["Connection"] = "keep-alive"
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    session.mount("http://", adapter)
+    yield session
+    session.close()
 
-    @ray.remote(num_gpus=1)
-    class InfeasibleActor:
-        pass
 
+@pytest.fixture
+def gcs_actor_subscriber(ray_start_with_dashboard):
+    """A GcsActorSubscriber primed before any test actors are created."""
+    sub = gcs_pubsub.GcsActorSubscriber(address=ray_start_with_dashboard["gcs_address"])
+    sub.subscribe()
+    yield sub
+    sub.close()
+
+
+def _get_actors(session, url, expected_count=0):
+    """Fetch the dashboard actor table from ``url``.
+
+    Returns the actor dict, or None without parsing when the payload is
+    too small to hold ``expected_count`` actors, so polling callers can
+    reject a stale response without paying for a JSON decode.
+    """
+    resp = session.get(url, timeout=2)
+    resp.raise_for_status()
+    min_bytes = expected_count * _MIN_ACTOR_ENTRY_BYTES
+    content_length = resp.headers.get("Content-Length")
+    if content_length is not None and int(content_length) < min_bytes:
+        return None
+    content = resp.content
+    if len(content) < min_bytes:
+        return None
+    return _json_loads(content)["data"]["actors"]
+
+
+def _drain_actor_states(sub, done, timeout):
+    """Consume actor state updates from ``sub`` until ``done(states)``
+    returns True or ``timeout`` elapses.
+
+    ``states`` maps actor id to the latest state published for it.
+    Returns the collected mapping either way; callers assert on it.
+    """
+    deadline = time.time() + timeout
+    states = {}
+    while not done(states):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        for _, actor_data in sub.poll(timeout=min(0.2, remaining)):
+            if actor_data is None:
+                continue
+            states[actor_data.actor_id] = actor_data.state
+    return states
+
+
+def _poll_until(fn, timeout, initial=0.05, cap=0.5, factor=1.5):
+    """Call ``fn`` repeatedly until it returns without raising.
+
+    Sleeps between attempts with geometric backoff, starting at
+    ``initial`` seconds and growing by ``factor`` up to ``cap``. The
+    final sleep is clamped so the deadline is never overslept. If the
+    deadline elapses, raises with the traceback of the last failure.
+    """
+    deadline = time.time() + timeout
+    interval = initial
+    last_ex = None
+    while True:
+        try:
+            fn()
+            return
+        except Exception as ex:
+            last_ex = ex
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            ex_stack = (
+                traceback.format_exception(
+                    type(last_ex), last_ex, last_ex.__traceback__
+                )
+                if last_ex
+                else []
+            )
+            ex_stack = "".join(ex_stack)
+            raise Exception(f"Timed out while testing, {ex_stack}")
+        time.sleep(min(interval, remaining))
+        interval = min(cap, interval * factor)
+
+
+def test_actors(
+    disable_aiohttp_cache, ray_start_with_dashboard, gcs_actor_subscriber, http_session
+):
     foo_actors = [Foo.remote(4), Foo.remote(5)]
     infeasible_actor = InfeasibleActor.remote()  # noqa
     results = [actor.do_task.remote() for actor in foo_actors]  # noqa
@@ -37,68 +192,66 @@ def test_actors(disable_aiohttp_cache, ray_start_with_dashboard):
     webui_url = format_web_url(webui_url)
 
     timeout_seconds = 5
-    start_time = time.time()
-    last_ex = None
-    while True:
-        time.sleep(1)
-        try:
-            resp = requests.get(f"{webui_url}/logical/actors")
-            resp_json = resp.json()
-            resp_data = resp_json["data"]
-            actors = resp_data["actors"]
-            assert len(actors) == 3
-            one_entry = list(actors.values())[0]
-            assert "jobId" in one_entry
-            assert "className" in one_entry
-            assert "address" in one_entry
-            assert type(one_entry["address"]) is dict
-            assert "state" in one_entry
-            assert "name" in one_entry
-            assert "numRestarts" in one_entry
-            assert "pid" in one_entry
-            all_pids = {entry["pid"] for entry in actors.values()}
-            assert 0 in all_pids  # The infeasible actor
-            assert len(all_pids) > 1
-            break
-        except Exception as ex:
-            last_ex = ex
-        finally:
-            if time.time() > start_time + timeout_seconds:
-                ex_stack = (
-                    traceback.format_exception(
-                        type(last_ex), last_ex, last_ex.__traceback__
-                    )
-                    if last_ex
-                    else []
-                )
-                ex_stack = "".join(ex_stack)
-                raise Exception(f"Timed out while testing, {ex_stack}")
 
+    # Wait on pushed state changes instead of polling the dashboard: the
+    # two Foo actors become ALIVE and the infeasible actor stays pending.
+    def actors_ready(states):
+        alive = sum(
+            state == gcs_utils.ActorTableData.ALIVE for state in states.values()
+        )
+        return len(states) == 3 and alive == 2
 
-def test_actor_pubsub(disable_aiohttp_cache, ray_start_with_dashboard):
+    states = _drain_actor_states(gcs_actor_subscriber, actors_ready, timeout_seconds)
+    assert actors_ready(states), states
+
+    def check_actors():
+        actors = _get_actors(
+            http_session, f"{webui_url}/logical/actors", expected_count=3
+        )
+        assert actors is not None
+        assert len(actors) == 3
+        one_entry = list(actors.values())[0]
+        assert "jobId" in one_entry
+        assert "className" in one_entry
+        assert "address" in one_entry
+        assert type(one_entry["address"]) is dict
+        assert "state" in one_entry
+        assert "name" in one_entry
+        assert "numRestarts" in one_entry
+        assert "pid" in one_entry
+        all_pids = {entry["pid"] for entry in actors.values()}
+        assert 0 in all_pids  # The infeasible actor
+        assert len(all_pids) > 1
+
+    _poll_until(check_actors, timeout_seconds)
+
+
+def test_actor_pubsub(
+    disable_aiohttp_cache, ray_start_with_dashboard, gcs_actor_subscriber
+):
     timeout = 5
     assert wait_until_server_available(ray_start_with_dashboard["webui_url"]) is True
-    address_info = ray_start_with_dashboard
 
-    sub = gcs_pubsub.GcsActorSubscriber(address=address_info["gcs_address"])
-    sub.subscribe()
-
-    @ray.remote
-    class DummyActor:
-        def __init__(self):
-            pass
+    sub = gcs_actor_subscriber
 
     # Create a dummy actor.
     a = DummyActor.remote()
 
     def handle_pub_messages(msgs, timeout, expect_num):
-        start_time = time.time()
-        while time.time() - start_time < timeout and len(msgs) < expect_num:
-            published = sub.poll(timeout=timeout)
+        # Pass the remaining budget down to each poll so the total wait
+        # is bounded by ``timeout`` rather than by timeout-per-poll.
+        deadline = time.time() + timeout
+        while len(msgs) < expect_num:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            published = sub.poll(timeout=max(0.05, remaining))
             for _, actor_data in published:
                 if actor_data is None:
                     continue
                 msgs.append(actor_data)
+                if len(msgs) >= expect_num:
+                    break
 
     msgs = []
     handle_pub_messages(msgs, timeout, 3)
@@ -116,18 +269,7 @@ def test_actor_pubsub(disable_aiohttp_cache, ray_start_with_dashboard):
     def actor_table_data_to_dict(message):
         return dashboard_utils.message_to_dict(
             message,
-            {
-                "actorId",
-                "parentId",
-                "jobId",
-                "workerId",
-                "rayletId",
-                "callerId",
-                "taskId",
-                "parentTaskId",
-                "sourceActorId",
-                "placementGroupId",
-            },
+            _BYTES_ID_FIELDS,
             including_default_value_fields=False,
         )
 
@@ -135,6 +277,7 @@ def test_actor_pubsub(disable_aiohttp_cache, ray_start_with_dashboard):
 
     for msg in msgs:
         actor_data_dict = actor_table_data_to_dict(msg)
+        actor_data_keys = actor_data_dict.keys()
         # DEPENDENCIES_UNREADY is 0, which would not be kept in dict. We
         # need check its original value.
         if msg.state == 0:
@@ -144,88 +287,46 @@ def test_actor_pubsub(disable_aiohttp_cache, ray_start_with_dashboard):
         # For status that is not DEPENDENCIES_UNREADY, only states fields will
         # be published.
         elif actor_data_dict["state"] in ("ALIVE", "DEAD"):
-            assert actor_data_dict.keys() >= {
-                "state",
-                "address",
-                "timestamp",
-                "pid",
-                "rayNamespace",
-            }
+            assert actor_data_keys >= _ALIVE_DEAD_REQUIRED
         elif actor_data_dict["state"] == "PENDING_CREATION":
-            assert actor_data_dict.keys() == {
-                "state",
-                "address",
-                "actorId",
-                "jobId",
-                "ownerAddress",
-                "className",
-                "serializedRuntimeEnv",
-                "rayNamespace",
-                "functionDescriptor",
-                "actorCreationDummyObjectId",
-            }
+            assert actor_data_keys == _PENDING_CREATION_KEYS
         else:
             raise Exception("Unknown state: {}".format(actor_data_dict["state"]))
 
 
-def test_nil_node(enable_test_module, disable_aiohttp_cache, ray_start_with_dashboard):
+def test_nil_node(
+    enable_test_module, disable_aiohttp_cache, ray_start_with_dashboard, http_session
+):
     assert wait_until_server_available(ray_start_with_dashboard["webui_url"]) is True
     webui_url = ray_start_with_dashboard["webui_url"]
     assert wait_until_server_available(webui_url)
     webui_url = format_web_url(webui_url)
 
-    @ray.remote(num_gpus=1)
-    class InfeasibleActor:
-        pass
-
     infeasible_actor = InfeasibleActor.remote()  # noqa
 
     timeout_seconds = 5
-    start_time = time.time()
-    last_ex = None
-    while True:
-        time.sleep(1)
-        try:
-            resp = requests.get(f"{webui_url}/logical/actors")
-            resp_json = resp.json()
-            resp_data = resp_json["data"]
-            actors = resp_data["actors"]
-            assert len(actors) == 1
-            response = requests.get(webui_url + "/test/dump?key=node_actors")
-            response.raise_for_status()
-            result = response.json()
-            assert actor_consts.NIL_NODE_ID not in result["data"]["nodeActors"]
-            break
-        except Exception as ex:
-            last_ex = ex
-        finally:
-            if time.time() > start_time + timeout_seconds:
-                ex_stack = (
-                    traceback.format_exception(
-                        type(last_ex), last_ex, last_ex.__traceback__
-                    )
-                    if last_ex
-                    else []
-                )
-                ex_stack = "".join(ex_stack)
-                raise Exception(f"Timed out while testing, {ex_stack}")
 
+    def check_nil_node():
+        actors = _get_actors(
+            http_session, f"{webui_url}/logical/actors", expected_count=1
+        )
+        assert actors is not None
+        assert len(actors) == 1
+        response = http_session.get(webui_url + "/test/dump?key=node_actors", timeout=2)
+        response.raise_for_status()
+        result = response.json()
+        assert actor_consts.NIL_NODE_ID not in result["data"]["nodeActors"]
 
-def test_actor_cleanup(
-    disable_aiohttp_cache, reduce_actor_cache, ray_start_with_dashboard
-):
-    @ray.remote
-    class Foo:
-        def __init__(self, num):
-            self.num = num
-
-        def do_task(self):
-            return self.num
+    _poll_until(check_nil_node, timeout_seconds)
 
-    @ray.remote(num_gpus=1)
-    class InfeasibleActor:
-        pass
 
+def test_actor_cleanup(
+    disable_aiohttp_cache,
+    reduce_actor_cache,
+    ray_start_with_dashboard,
+    gcs_actor_subscriber,
+    http_session,
+):
     infeasible_actor = InfeasibleActor.remote()  # noqa
 
     foo_actors = [
@@ -242,66 +343,52 @@ def test_actor_cleanup(
     webui_url = format_web_url(webui_url)
 
     timeout_seconds = 8
-    start_time = time.time()
-    last_ex = None
-    while True:
-        time.sleep(1)
-        try:
-            resp = requests.get(f"{webui_url}/logical/actors")
-            resp_json = resp.json()
-            resp_data = resp_json["data"]
-            actors = resp_data["actors"]
-            # Although max cache is 3, there should be 7 actors
-            # because they are all still alive.
-            assert len(actors) == 7
 
-            break
-        except Exception as ex:
-            last_ex = ex
-        finally:
-            if time.time() > start_time + timeout_seconds:
-                ex_stack = (
-                    traceback.format_exception(
-                        type(last_ex), last_ex, last_ex.__traceback__
-                    )
-                    if last_ex
-                    else []
-                )
-                ex_stack = "".join(ex_stack)
-                raise Exception(f"Timed out while testing, {ex_stack}")
+    # Wait on pushed state changes: the six Foo actors become ALIVE and
+    # the infeasible actor stays pending, giving 7 published actor ids.
+    def actors_created(states):
+        alive = sum(
+            state == gcs_utils.ActorTableData.ALIVE for state in states.values()
+        )
+        return len(states) == 7 and alive == 6
+
+    states = _drain_actor_states(gcs_actor_subscriber, actors_created, timeout_seconds)
+    assert actors_created(states), states
+
+    def check_actors_alive():
+        actors = _get_actors(
+            http_session, f"{webui_url}/logical/actors", expected_count=7
+        )
+        assert actors is not None
+        # Although max cache is 3, there should be 7 actors
+        # because they are all still alive.
+        assert len(actors) == 7
+
+    _poll_until(check_actors_alive, timeout_seconds)
 
     # kill
     ray.kill(infeasible_actor)
     [ray.kill(foo_actor) for foo_actor in foo_actors]
-    # Wait 5 seconds for cleanup to finish
-    time.sleep(5)
 
-    # Check only three remaining in cache
-    start_time = time.time()
-    while True:
-        time.sleep(1)
-        try:
-            resp = requests.get(f"{webui_url}/logical/actors")
-            resp_json = resp.json()
-            resp_data = resp_json["data"]
-            actors = resp_data["actors"]
-            # Max cache is 3 so only 3 actors should be left.
-            assert len(actors) == 3
+    # All 7 actors should publish a DEAD state change. Cap the wait at
+    # 5 seconds so a stuck cluster fails fast instead of hanging.
+    def actors_dead(states):
+        dead = sum(state == gcs_utils.ActorTableData.DEAD for state in states.values())
+        return dead == 7
 
-            break
-        except Exception as ex:
-            last_ex = ex
-        finally:
-            if time.time() > start_time + timeout_seconds:
-                ex_stack = (
-                    traceback.format_exception(
-                        type(last_ex), last_ex, last_ex.__traceback__
-                    )
-                    if last_ex
-                    else []
-                )
-                ex_stack = "".join(ex_stack)
-                raise Exception(f"Timed out while testing, {ex_stack}")
+    states = _drain_actor_states(gcs_actor_subscriber, actors_dead, 5)
+    assert actors_dead(states), states
+
+    def check_actors_evicted():
+        actors = _get_actors(
+            http_session, f"{webui_url}/logical/actors", expected_count=3
+        )
+        assert actors is not None
+        # Max cache is 3 so only 3 actors should be left.
+        assert len(actors) == 3
+
+    # Check only three remaining in cache
+    _poll_until(check_actors_evicted, timeout_seconds)
 
 
 if __name__ == "__main__":